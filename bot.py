@@ -1,6 +1,8 @@
 #!/usr/bin/python3 -u
 
 from enum import Enum
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlencode
 from datetime import datetime
 import logging
@@ -15,6 +17,9 @@ import random
 import string
 import html
 import sys
+import gzip
+import signal
+import difflib
 
 try:
     import config
@@ -43,13 +48,550 @@ class TransactionType(Enum):
     RECHARGE = 4
 
 
+class TrafficRecorder():
+    # Writes every HTTP exchange of the bridge as one JSON line to a gzip file.
+    # Paths are stored relative to the API base url, so the bot token never
+    # ends up in a trace. See replay.py for feeding a trace back.
+    def __init__(self, filename):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.lock = threading.Lock()
+        self.filename = filename
+        self.file = gzip.open(filename, 'wt', encoding='utf-8')
+        self.logger.info("Recording HTTP traffic to %s", filename)
+
+    def record(self, service, method, path, started, params=None, data=None, response=None, error=None):
+        entry = dict(t=started,
+                     elapsed=time.time() - started,
+                     source=threading.current_thread().name,
+                     service=service,
+                     method=method,
+                     path=path,
+                     params=params,
+                     data=data)
+        if response is not None:
+            entry['status'] = response.status_code
+            entry['contentType'] = response.headers.get('content-type')
+            entry['body'] = response.text
+        if error is not None:
+            entry['error'] = error
+
+        line = json.dumps(entry)
+        with self.lock:
+            self.file.write(line + "\n")
+            # sync flush keeps the trace readable if the bridge gets killed
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class AlertEngine():
+    # Per user low-balance and daily spending alerts. Rules are indexed by
+    # Strichliste user id and evaluated from the transactions the watcher
+    # already fetched, so no extra API calls are needed. Every rule remembers
+    # if its limit is crossed, to alert only once per crossing.
+    def __init__(self, main, filename):
+        self.main = main
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.lock = threading.Lock()
+        self.filename = filename
+        self.rules = {}
+        self.load()
+
+    def load(self):
+        if not os.path.isfile(self.filename) or os.stat(self.filename).st_size == 0:
+            return
+        try:
+            with open(self.filename, 'r') as f:
+                self.rules = json.load(f)
+
+            self.logger.debug("alertRulesFile successful loaded")
+
+        except Exception as ex:
+            # don't overwrite the rules of all users with the next save()
+            self.logger.exception("Caught an exception in load(): %s", ex)
+            sys.exit()
+
+    # must be called with self.lock held
+    def save(self):
+        try:
+            with open(self.filename, 'w') as f:
+                json.dump(self.rules, f)
+
+            self.logger.debug("alertRulesFile successful saved")
+
+        except Exception as ex:
+            self.logger.exception("Caught an exception in save(): %s", ex)
+
+    def getRules(self, sl_id):
+        with self.lock:
+            return json.loads(json.dumps(self.rules.get(str(sl_id), {})))
+
+    def setBalanceRule(self, sl_id, threshold, balance):
+        with self.lock:
+            self.rules.setdefault(str(sl_id), {})['balance'] = dict(
+                threshold=threshold, crossed=balance < threshold)
+            self.save()
+
+    # transactions are the user's latest transactions, today's spending
+    # is counted from them. Returns what was spent today so far.
+    def setDailyRule(self, sl_id, limit, transactions):
+        date = datetime.now().strftime('%Y-%m-%d')
+        counted = [transaction['id'] for transaction in transactions
+                   if transaction['created'][:10] == date and self.isSpending(transaction)
+                   and not transaction['isDeleted']]
+        spent = -sum(transaction['amount'] for transaction in transactions
+                     if transaction['id'] in counted)
+        with self.lock:
+            self.rules.setdefault(str(sl_id), {})['daily'] = dict(
+                limit=limit, date=date, spent=spent, counted=counted, crossed=spent > limit)
+            self.save()
+        return spent
+
+    @staticmethod
+    def isSpending(transaction):
+        # bought an article or sent money
+        return transaction['amount'] < 0 and not transaction['sender'] and (
+            transaction['article'] or transaction['recipient'])
+
+    def deleteRules(self, sl_id, kind=None):
+        with self.lock:
+            rules = self.rules.get(str(sl_id))
+            if rules is None:
+                return
+            if kind is None:
+                del self.rules[str(sl_id)]
+            else:
+                rules.pop(kind, None)
+                if not rules:
+                    del self.rules[str(sl_id)]
+            self.save()
+
+    def processTransaction(self, transaction, transactType, isUndo, chatid):
+        messages = []
+        with self.lock:
+            rules = self.rules.get(str(transaction['user']['id']))
+            if not rules:
+                return
+
+            changed = False
+            rule = rules.get('balance')
+            if rule:
+                balance = transaction['user']['balance']
+                crossed = balance < rule['threshold']
+                if crossed and not rule['crossed']:
+                    messages.append(str("<b>"+u'\u26a0\ufe0f'+" Low balance!</b>\n\n"
+                                        "Your balance of <b>%.2lf€</b> is below your limit of <b>%.2lf€</b>." % (
+                                            balance/100, rule['threshold']/100)))
+                if crossed != rule['crossed']:
+                    rule['crossed'] = crossed
+                    changed = True
+
+            rule = rules.get('daily')
+            if rule and transactType in (TransactionType.BUY_ARTICLE, TransactionType.SEND_MONEY) and transaction['amount'] < 0:
+                date = transaction['created'][:10]
+                if date > rule['date']:
+                    rule.update(date=date, spent=0, counted=[], crossed=False)
+                # count every transaction once, undo only what was counted
+                counted = transaction['id'] in rule['counted']
+                if date == rule['date'] and isUndo == counted:
+                    if isUndo:
+                        rule['spent'] += transaction['amount']
+                        rule['counted'].remove(transaction['id'])
+                    else:
+                        rule['spent'] -= transaction['amount']
+                        rule['counted'].append(transaction['id'])
+                    crossed = rule['spent'] > rule['limit']
+                    if crossed and not rule['crossed']:
+                        messages.append(str("<b>"+u'\u26a0\ufe0f'+" Daily spending limit exceeded!</b>\n\n"
+                                            "You spent <b>%.2lf€</b> today, your limit is <b>%.2lf€</b>." % (
+                                                rule['spent']/100, rule['limit']/100)))
+                    rule['crossed'] = crossed
+                    changed = True
+
+            if changed:
+                self.save()
+
+        for message in messages:
+            self.main.send_msg(message, markup="HTML", chatID=chatid)
+
+
+class ArticleCatalog(threading.Thread):
+    # Keeps the active Strichliste articles in memory and refreshes them every
+    # config.articles['ttl'] seconds, conditionally if the API sends an ETag
+    # or Last-Modified. search() looks up barcodes and word prefixes of the
+    # article names in prebuilt indexes and falls back to fuzzy matching.
+    def __init__(self, main):
+        threading.Thread.__init__(self, name=self.__class__.__name__)
+        self.main = main
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.do_stop = False
+        self.wakeup = threading.Event()
+        self.etag = None
+        self.lastModified = None
+        # replaced as a whole on refresh, so readers need no lock
+        self.index = dict(articles={}, prefixes={}, barcodes={}, names={})
+
+    def run(self):
+        self.logger.debug("ArticleCatalog is running")
+        settings = getattr(config, 'articles', {})
+        while not self.do_stop:
+            try:
+                self.refresh(settings.get('limit', 1000))
+            except Exception as ex:
+                self.logger.exception(
+                    "Exception caught in refresh! " + str(ex))
+            self.wakeup.wait(settings.get('ttl', 300))
+
+        self.logger.debug("ArticleCatalog exits NOW.")
+
+    def stop(self):
+        self.do_stop = True
+        self.wakeup.set()
+
+    def refresh(self, limit):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.lastModified:
+            headers['If-Modified-Since'] = self.lastModified
+
+        req = self.main.request("GET", "strichliste", "/article", params={
+                                'active': 'true', 'limit': limit}, headers=headers, timeout=10)
+        if req.status_code == 304:
+            self.logger.debug("Article list not modified.")
+            return
+        if req.status_code != 200:
+            self.logger.warning(
+                "Strichliste API responded with code %s to /article.", str(req.status_code))
+            return
+        self.etag = req.headers.get('etag')
+        self.lastModified = req.headers.get('last-modified')
+
+        articles = {article['id']: article for article in req.json()['articles']
+                    if article.get('isActive', True)}
+        if articles == self.index['articles']:
+            self.logger.debug("Article list unchanged.")
+            return
+
+        prefixes = {}
+        barcodes = {}
+        names = {}
+        for article in articles.values():
+            name = article['name'].lower()
+            names.setdefault(name, []).append(article['id'])
+            for word in name.split():
+                for i in range(1, len(word) + 1):
+                    prefixes.setdefault(word[:i], set()).add(article['id'])
+            if article.get('barcode'):
+                # search() looks up lowercase
+                barcodes[article['barcode'].strip().lower()] = article['id']
+
+        self.index = dict(articles=articles, prefixes=prefixes,
+                          barcodes=barcodes, names=names)
+        self.logger.info("Loaded %d articles.", len(articles))
+
+    def get(self, articleId):
+        return self.index['articles'].get(articleId)
+
+    def isEmpty(self):
+        return not self.index['articles']
+
+    def search(self, query, limit=5):
+        index = self.index
+        query = query.strip().lower()
+        if query in index['barcodes']:
+            return [index['articles'][index['barcodes'][query]]]
+
+        ids = None
+        for word in query.split():
+            found = index['prefixes'].get(word, set())
+            ids = found if ids is None else ids & found
+        if not ids:
+            # maybe a typo
+            ids = set()
+            for name in difflib.get_close_matches(query, index['names'].keys(), n=limit, cutoff=0.6):
+                ids.update(index['names'][name])
+
+        found = [index['articles'][articleId] for articleId in ids]
+        found.sort(key=lambda article: (not article['name'].lower().startswith(query),
+                                        len(article['name']), article['name']))
+        return found[:limit]
+
+
+class Sampler(threading.Thread):
+    # Sampling profiler for all threads of the bridge. Takes the stacks of
+    # every thread each interval and writes them as collapsed stacks
+    # (thread;frame;frame count), ready for flamegraph.pl or speedscope.
+    def __init__(self, filename, seconds, interval, callback=None):
+        threading.Thread.__init__(self, name=self.__class__.__name__)
+        self.daemon = True
+        self.filename = filename
+        self.seconds = seconds
+        self.interval = interval
+        self.callback = callback
+        self.do_stop = False
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def run(self):
+        stacks = {}
+        leafs = {}
+        samples = 0
+        end = time.time() + self.seconds
+        while not self.do_stop and time.time() < end:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == self.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append("%s (%s:%d)" % (frame.f_code.co_name, os.path.basename(
+                        frame.f_code.co_filename), frame.f_code.co_firstlineno))
+                    frame = frame.f_back
+                key = ";".join([names.get(ident, str(ident))] + stack[::-1])
+                stacks[key] = stacks.get(key, 0) + 1
+                leafs[stack[0]] = leafs.get(stack[0], 0) + 1
+            samples += 1
+            time.sleep(self.interval)
+
+        try:
+            with open(self.filename, 'w') as f:
+                for key, count in sorted(stacks.items(), key=lambda item: -item[1]):
+                    f.write("%s %d\n" % (key, count))
+            self.logger.info("Wrote %d samples to %s", samples, self.filename)
+        except Exception as ex:
+            self.logger.exception("Caught an exception in run(): %s", ex)
+
+        summary = "%d samples, written to %s\n" % (samples, self.filename)
+        for leaf, count in sorted(leafs.items(), key=lambda item: -item[1])[:10]:
+            summary += "%5.1f%% %s\n" % (100 * count / max(1, samples), leaf)
+        if self.callback:
+            self.callback(summary)
+
+    def stop(self):
+        self.do_stop = True
+
+
+class DebugHooks():
+    # Thread dumps, sampling profiles and watcher tick timings for the running
+    # bridge. Triggered by SIGUSR1 (thread dump), SIGUSR2 (toggle profile) or
+    # the admin command /debug. Nothing runs until one of them is used.
+    def __init__(self, main):
+        self.main = main
+        self.logger = logging.getLogger(self.__class__.__name__)
+        settings = getattr(config, 'debug', {})
+        self.dir = os.path.join(scriptdir, settings.get('dir', "debug"))
+        self.profileSeconds = settings.get('profileSeconds', 30)
+        self.sampleInterval = settings.get('sampleInterval', 0.01)
+        self.sampler = None
+
+    # must be called from the main thread
+    def installSignalHandlers(self):
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.dumpThreads())
+            signal.signal(signal.SIGUSR2, lambda signum, frame: self.toggleProfile())
+
+    def filename(self, kind, extension):
+        os.makedirs(self.dir, exist_ok=True)
+        return os.path.join(self.dir, "%s-%s.%s" % (kind, datetime.now().strftime('%Y%m%d-%H%M%S'), extension))
+
+    # Writes the stacks of all threads to a file. Returns the file name and a
+    # short version with the innermost frames of every thread.
+    def dumpThreads(self, depth=3):
+        full = ""
+        short = ""
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            stack = traceback.extract_stack(frame)
+            full += "Thread %s:\n%s\n" % (names.get(ident, ident), "".join(traceback.format_list(stack)))
+            short += "%s:\n%s\n" % (names.get(ident, ident), "\n".join(
+                "  %s (%s:%d)" % (entry.name, os.path.basename(entry.filename), entry.lineno) for entry in stack[-depth:]))
+
+        filename = None
+        try:
+            filename = self.filename("threads", "txt")
+            with open(filename, 'w') as f:
+                f.write(full)
+            self.logger.info("Wrote thread dump to %s", filename)
+        except Exception as ex:
+            self.logger.exception("Caught an exception in dumpThreads(): %s", ex)
+        return filename, short
+
+    # Starts a sampling profile for seconds, or stops a running one early.
+    # Returns True if a profile was started.
+    def toggleProfile(self, seconds=None, callback=None):
+        if self.sampler is not None and self.sampler.is_alive():
+            self.logger.info("Stopping profile.")
+            self.sampler.stop()
+            self.sampler = None
+            return False
+        try:
+            filename = self.filename("profile", "txt")
+        except Exception as ex:
+            self.logger.exception("Caught an exception in toggleProfile(): %s", ex)
+            return False
+        seconds = seconds or self.profileSeconds
+        self.logger.info("Profiling for %ds.", seconds)
+        self.sampler = Sampler(filename, seconds, self.sampleInterval, callback)
+        self.sampler.start()
+        return True
+
+    def formatTicks(self):
+        watcher = self.main.threadStrichlisteWatcher
+        if watcher is None or not watcher.tickTimings:
+            return "No watcher ticks recorded."
+        message = "%-8s %5s %9s %9s %9s %9s\n" % (
+            "Time", "Users", "List", "Fetch", "Process", "Total")
+        for tick in watcher.tickTimings:
+            message += "%-8s %5d %7.0fms %7.0fms %7.0fms %7.0fms%s\n" % (
+                tick['time'], tick['users'], tick['userlist'] * 1000, tick['fetch'] * 1000,
+                (tick['transactions'] - tick['fetch']) * 1000, tick['total'] * 1000,
+                " !" if tick['error'] else "")
+        return message
+
+
+class Broadcaster(threading.Thread):
+    # Sends a message to all mapped chats in batches of config.broadcast['rate']
+    # messages per second. The delivery state of every recipient is saved
+    # after each batch, so an interrupted broadcast resumes where it stopped.
+    # Network and server errors are retried with backoff, up to
+    # config.broadcast['attempts'] times. Other errors are final.
+    def __init__(self, main, state):
+        threading.Thread.__init__(self, name=self.__class__.__name__)
+        self.main = main
+        self.state = state
+        self.reportChatID = state.get('reportChatID')
+        self.do_stop = False
+        self.wakeup = threading.Event()
+        self.lastReport = 0
+        self.started = None
+        self.done = 0
+        self.total = 0
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    @staticmethod
+    def isRetryable(state, chatid):
+        status = state['recipients'][chatid]
+        attempts = state['attempts'].get(chatid, 0)
+        return status == "pending" or (status == "failed" and attempts < getattr(config, 'broadcast', {}).get('attempts', 3))
+
+    def run(self):
+        recipients = self.state['recipients']
+        settings = getattr(config, 'broadcast', {})
+        rate = settings.get('rate', 25)
+        delay = settings.get('retryDelay', 10)
+
+        self.started = time.time()
+        try:
+            with ThreadPoolExecutor(max_workers=rate) as pool:
+                # every round counts an attempt for all chats that failed,
+                # so config.broadcast['attempts'] limits the rounds
+                while not self.do_stop:
+                    todo = [chatid for chatid in recipients
+                            if self.isRetryable(self.state, chatid)]
+                    if not todo:
+                        break
+                    if self.total:
+                        self.logger.info(
+                            "Retrying %d chats in %gs.", len(todo), delay)
+                        self.wakeup.wait(delay)
+                        delay *= 2
+                        if self.do_stop:
+                            break
+                    else:
+                        self.logger.info("Broadcasting to %d of %d chats.",
+                                         len(todo), len(recipients))
+                    self.total += len(todo)
+                    self.sendBatches(pool, todo, rate)
+        except Exception as ex:
+            self.logger.exception(
+                "An Exception crashed the Broadcaster: " + str(ex))
+
+        if not any(self.isRetryable(self.state, chatid) for chatid in recipients):
+            self.state['finished'] = True
+            self.main.saveBroadcastState(self.state)
+        self.report(final=True)
+
+    def sendBatches(self, pool, todo, rate):
+        recipients = self.state['recipients']
+        attempts = self.state['attempts']
+        for i in range(0, len(todo), rate):
+            if self.do_stop:
+                break
+            batchStarted = time.time()
+            batch = todo[i:i + rate]
+            for chatid, status in zip(batch, pool.map(self.deliver, batch)):
+                recipients[chatid] = status
+                if status not in ("pending", "skipped"):
+                    attempts[chatid] = attempts.get(chatid, 0) + 1
+                if status == "blocked" and self.main.deleteAuthorizedChat(chatid):
+                    self.logger.info(
+                        "Chat %s blocked the bot. Unmapped it.", chatid)
+            self.done += len(batch)
+            self.main.saveBroadcastState(self.state)
+            self.report()
+
+            wait = 1 - (time.time() - batchStarted)
+            if wait > 0:
+                time.sleep(wait)
+
+    def deliver(self, chatid):
+        # the user may have unmapped since the broadcast started
+        if not self.main.isAuthorizedUser(telegram_chat_id=chatid):
+            return "skipped"
+        while not self.do_stop:
+            r = self.main.send_msg(self.state['message'], chatID=chatid)
+            if r is None:
+                return "failed"
+            if r.status_code == 200:
+                return "sent"
+            if r.status_code == 403:
+                return "blocked"
+            if 400 <= r.status_code < 500 and r.status_code != 429:
+                # e.g. chat not found or message too long, retrying won't help
+                return "rejected"
+            if r.status_code != 429:
+                return "failed"
+            retry = r.json().get('parameters', {}).get('retry_after', 1)
+            self.logger.warning(
+                "Hit Telegram rate limit. Waiting %ss.", str(retry))
+            time.sleep(retry)
+        return "pending"
+
+    def report(self, final=False):
+        done = self.done
+        total = self.total
+        elapsed = time.time() - self.started
+        counts = {}
+        for status in self.state['recipients'].values():
+            counts[status] = counts.get(status, 0) + 1
+        message = str("Broadcast %s: %d/%d chats in %.0fs (%.1f msg/s)\n"
+                      "Sent: %d, blocked: %d, rejected: %d, failed: %d, skipped: %d" % (
+                          "finished" if final else "running", done, total, elapsed,
+                          done / elapsed if elapsed > 0 else 0,
+                          counts.get("sent", 0), counts.get("blocked", 0), counts.get("rejected", 0),
+                          counts.get("failed", 0), counts.get("skipped", 0)))
+        self.logger.info(message.replace("\n", " "))
+        # don't flood the admin with progress
+        if self.reportChatID and (final or time.time() - self.lastReport >= 30):
+            self.lastReport = time.time()
+            self.main.send_msg(message, chatID=self.reportChatID)
+
+    def stop(self):
+        self.do_stop = True
+        self.wakeup.set()
+
+
 class TelegramListener(threading.Thread):
     def __init__(self, main):
-        threading.Thread.__init__(self)
+        threading.Thread.__init__(self, name=self.__class__.__name__)
         self.update_offset = 0
         self.first_contact = True
         self.main = main
         self.do_stop = False
+        # (chat_id, message_id) of keyboards already answered
+        self.handledCallbacks = deque(maxlen=100)
         self.logger = logging.getLogger(self.__class__.__name__)
 
     def run(self):
@@ -128,6 +670,8 @@ class TelegramListener(threading.Thread):
             else:
                 self.logger.warning(
                     "Got an unknown message. Doing nothing. Data: " + str(message))
+        elif 'callback_query' in message and 'message' in message['callback_query']:
+            self.handleCallbackQuery(message['callback_query'])
         else:
             self.logger.warning(
                 "Response is missing .message or .message.chat or callback_query. Skipping it.")
@@ -136,7 +680,8 @@ class TelegramListener(threading.Thread):
     def handleTextMessage(self, message, chat_id, from_id):
         # We got a chat message.
         # handle special messages from groups (/commad@BotName)
-        command = str(message['message']['text'].split('@')[0])
+        args = message['message']['text'].split()
+        command = str(args.pop(0).split('@')[0]) if args else ""
 
         sl_id = self.main.isAuthorizedUser(telegram_chat_id=chat_id)
 
@@ -159,11 +704,25 @@ class TelegramListener(threading.Thread):
                 "Send money to someone user within the next <b>two</b> minutes (can be undo immediately) with the following token in the note:\n\n<code>%s</code>" % token, markup="HTML", chatID=chat_id)
             self.main.pendingActivations[token] = dict(
                 time=time.time(), chatid=chat_id)
+
+        elif command == "/debug" and self.main.isAdmin(chat_id):
+
+            self.handleDebugCommand(args, chat_id)
+
+        elif command == "/broadcast" and self.main.isAdmin(chat_id):
+
+            text = message['message']['text'].split(None, 1)
+            if len(text) < 2:
+                self.main.send_msg(
+                    "Usage: <code>/broadcast message</code>", chatID=chat_id, markup="HTML")
+            elif not self.main.startBroadcast(text[1], reportChatID=chat_id):
+                self.main.send_msg(
+                    "A broadcast is already running.", chatID=chat_id)
         else:
 
             if not sl_id:  # unauthorized user
 
-                if command == "/unmap" or command == "/me" or command == "/balance":
+                if command == "/unmap" or command == "/me" or command == "/balance" or command == "/alert" or command == "/buy":
 
                     self.main.send_msg(
                         "You are not allowed to do this!\nYou must first /map your Telegram to your Strichliste account!", chatID=chat_id)
@@ -215,10 +774,169 @@ class TelegramListener(threading.Thread):
 
                     self.main.send_msg(message, chatID=chat_id, markup="HTML")
 
+                elif command == "/alert":
+
+                    self.handleAlertCommand(args, chat_id, sl_id)
+
+                elif command == "/buy":
+
+                    self.handleBuyCommand(args, chat_id)
+
                 else:
                     self.main.send_msg(
                         "Unkown command. Enter / in the chat or click on the [/] to see all available commands.", chatID=chat_id)
 
+    def handleAlertCommand(self, args, chat_id, sl_id):
+        usage = str("Usage:\n"
+                    "<code>/alert balance 5</code> - warn when your balance drops below 5€\n"
+                    "<code>/alert daily 10</code> - warn when you spend more than 10€ a day, including today's purchases\n"
+                    "<code>/alert off [balance|daily]</code> - remove alerts")
+
+        if len(args) == 0:
+            rules = self.main.alerts.getRules(sl_id)
+            message = "Your alerts:\n"
+            if 'balance' in rules:
+                message += "Balance below: <b>%.2lf€</b>\n" % (rules['balance']['threshold']/100)
+            if 'daily' in rules:
+                message += "Daily spending above: <b>%.2lf€</b>\n" % (rules['daily']['limit']/100)
+            if not rules:
+                message += "---\n"
+            self.main.send_msg(message + "\n" + usage, chatID=chat_id, markup="HTML")
+
+        elif args[0] == "off" and len(args) <= 2:
+            kind = args[1] if len(args) == 2 else None
+            if kind not in (None, "balance", "daily"):
+                self.main.send_msg(usage, chatID=chat_id, markup="HTML")
+                return
+            self.main.alerts.deleteRules(sl_id, kind)
+            self.main.send_msg("Alerts removed.", chatID=chat_id)
+
+        elif args[0] in ("balance", "daily") and len(args) == 2:
+            try:
+                amount = int(round(float(args[1].replace(',', '.').rstrip('€')) * 100))
+            except (ValueError, OverflowError):
+                self.main.send_msg(usage, chatID=chat_id, markup="HTML")
+                return
+
+            if args[0] == "balance":
+                balance = self.main.getUserInfo(sl_id)['user']['balance']
+                self.main.alerts.setBalanceRule(sl_id, amount, balance)
+                message = "You will be warned when your balance drops below <b>%.2lf€</b>." % (amount/100)
+                if balance < amount:
+                    message += "\nYour balance of <b>%.2lf€</b> is already below." % (balance/100)
+            else:
+                spent = self.main.alerts.setDailyRule(
+                    sl_id, amount, self.main.getUserTransactions(sl_id)['transactions'])
+                message = str("You will be warned when you spend more than <b>%.2lf€</b> a day.\n"
+                              "You spent <b>%.2lf€</b> today so far." % (amount/100, spent/100))
+                if spent > amount:
+                    message += "\nThat is already above your limit."
+            self.main.send_msg(message, chatID=chat_id, markup="HTML")
+
+        else:
+            self.main.send_msg(usage, chatID=chat_id, markup="HTML")
+
+    def handleDebugCommand(self, args, chat_id):
+        debug = self.main.debugHooks
+
+        if args[:1] == ["threads"]:
+            filename, short = debug.dumpThreads()
+            self.main.send_msg("<pre>%s</pre>\nFull dump: <code>%s</code>" % (
+                html.escape(short[:3500]), html.escape(str(filename))), chatID=chat_id, markup="HTML")
+
+        elif args[:1] == ["profile"]:
+            try:
+                seconds = int(args[1]) if len(args) > 1 else None
+            except ValueError:
+                seconds = None
+            started = debug.toggleProfile(seconds, callback=lambda summary: self.main.send_msg(
+                "<pre>%s</pre>" % html.escape(summary), chatID=chat_id, markup="HTML"))
+            self.main.send_msg("Profiling started." if started else "Profiling stopped.", chatID=chat_id)
+
+        elif args[:1] == ["ticks"]:
+            self.main.send_msg("<pre>%s</pre>" % html.escape(debug.formatTicks()[-3500:]),
+                               chatID=chat_id, markup="HTML")
+
+        else:
+            self.main.send_msg(str("Usage:\n"
+                                   "<code>/debug threads</code> - stacks of all threads\n"
+                                   "<code>/debug profile [seconds]</code> - start/stop a sampling profile\n"
+                                   "<code>/debug ticks</code> - timing of the last watcher ticks"),
+                               chatID=chat_id, markup="HTML")
+
+    def handleBuyCommand(self, args, chat_id):
+        catalog = self.main.threadArticleCatalog
+        if len(args) == 0:
+            self.main.send_msg(
+                "Usage: <code>/buy name or barcode</code>", chatID=chat_id, markup="HTML")
+        elif catalog is None or catalog.isEmpty():
+            self.main.send_msg(
+                "The article list is not loaded yet. Try again later.", chatID=chat_id)
+        else:
+            articles = catalog.search(" ".join(args))
+            if not articles:
+                self.main.send_msg("No article found.", chatID=chat_id)
+                return
+            responses = [[("%s (%.2lf€)" % (article['name'], article['amount']/100), "buy:%d" % article['id'])]
+                         for article in articles]
+            responses.append([("Cancel", "buy:cancel")])
+            self.main.send_msg("What do you want to buy?",
+                               responses=responses, chatID=chat_id)
+
+    def handleCallbackQuery(self, callback):
+        chat_id = str(callback['message']['chat']['id'])
+        message_id = callback['message']['message_id']
+        data = callback.get('data', "")
+
+        # only the first press on a keyboard counts
+        if (chat_id, message_id) in self.handledCallbacks:
+            self.main.answer_callback(callback['id'])
+            return
+        self.handledCallbacks.append((chat_id, message_id))
+
+        if data.startswith("buy:"):
+            self.handleBuyCallback(
+                data[len("buy:"):], callback['id'], chat_id, message_id)
+        else:
+            self.logger.warning(
+                "Got an unknown callback_query. Doing nothing. Data: " + str(callback))
+            self.main.answer_callback(callback['id'])
+
+    def handleBuyCallback(self, articleId, callback_id, chat_id, message_id):
+        self.main.answer_callback(callback_id)
+        if articleId == "cancel":
+            self.main.edit_msg("Purchase cancelled.", chatID=chat_id, messageID=message_id)
+            return
+
+        sl_id = self.main.isAuthorizedUser(telegram_chat_id=chat_id)
+        article = self.main.threadArticleCatalog.get(int(articleId)) if self.main.threadArticleCatalog else None
+        if not sl_id:
+            message = "You must first /map your Telegram to your Strichliste account!"
+        elif article is None:
+            message = "This article is not available anymore."
+        else:
+            try:
+                req = self.main.request("POST", "strichliste", "/user/%s/transaction" % sl_id, json=dict(
+                    articleId=article['id'], quantity=1), timeout=10)
+                if req.status_code == 200:
+                    transaction = req.json()['transaction']
+                    message = str("Bought <b>%s</b> for <b>%.2lf€</b>.\n"
+                                  "New balance: <b>%.2lf€</b>" % (
+                                      html.escape(article['name']), -transaction['amount']/100,
+                                      transaction['user']['balance']/100))
+                else:
+                    self.logger.warning("Buying article %d failed with code %s: %s", article['id'],
+                                        str(req.status_code), req.text)
+                    message = "Purchase failed: <b>%s</b>" % html.escape(
+                        str(req.json().get('error', {}).get('message', req.status_code)))
+            except Exception as ex:
+                self.logger.exception(
+                    "Caught an exception while buying: " + str(ex))
+                message = "Purchase failed."
+
+        self.main.edit_msg(message, chatID=chat_id,
+                           messageID=message_id, markup="HTML")
+
     def parseUserData(self, message):
         chat = message['message']['chat']
         chat_id = str(chat['id'])
@@ -235,7 +953,7 @@ class TelegramListener(threading.Thread):
             if self.update_offset == 0 and self.first_contact:
                 res = ["0", "0"]
                 while len(res) > 0:
-                    req = requests.get(self.main.bot_url + "/getUpdates", params={
+                    req = self.main.request("GET", "telegram", "/getUpdates", params={
                                        'offset': self.update_offset, 'timeout': 0}, allow_redirects=False, timeout=10)
                     json = req.json()
                     if not json['ok']:
@@ -253,7 +971,7 @@ class TelegramListener(threading.Thread):
                 if self.update_offset == 0:
                     self.set_update_offset(0)
             else:
-                req = requests.get(self.main.bot_url + "/getUpdates", params={
+                req = self.main.request("GET", "telegram", "/getUpdates", params={
                                    'offset': self.update_offset, 'timeout': 30}, allow_redirects=False, timeout=40)
         except requests.exceptions.Timeout:
             # Just start the next loop.
@@ -292,7 +1010,7 @@ class TelegramListener(threading.Thread):
         self.do_stop = True
 
     def test_token(self):
-        response = requests.get(self.main.bot_url+"/getMe")
+        response = self.main.request("GET", "telegram", "/getMe")
         self.logger.debug("getMe returned: " + str(response.json()))
         self.logger.debug("getMe status code: " + str(response.status_code))
         json = response.json()
@@ -308,13 +1026,17 @@ class TelegramListener(threading.Thread):
 
 class StrichlisteWatcher(threading.Thread):
     def __init__(self, main):
-        threading.Thread.__init__(self)
+        threading.Thread.__init__(self, name=self.__class__.__name__)
         self.main = main
         self.logger = logging.getLogger(self.__class__.__name__)
         self.do_stop = False
         self.latestUserList = None
         self.cachedUserList = None
         self.transactionsDeletableList = []
+        # per stage timing of the last ticks, see DebugHooks.formatTicks()
+        self.tickTimings = deque(
+            maxlen=getattr(config, 'debug', {}).get('ticks', 20))
+        self.tick = None
 
     def run(self):
         self.logger.debug("StrichlisteWatcher is running")
@@ -332,17 +1054,24 @@ class StrichlisteWatcher(threading.Thread):
         self.logger.debug("StrichlisteWatcher exits NOW.")
 
     def loop(self):
+        started = time.perf_counter()
+        self.tick = dict(time=datetime.now().strftime('%H:%M:%S'), users=0, userlist=0,
+                         fetch=0, transactions=0, total=0, error=True)
         try:
-            req = requests.get(config.strichliste['apiurl'] + "/user")
+            req = self.main.request("GET", "strichliste", "/user")
             self.latestUserList = req.json()
+            self.tick['userlist'] = time.perf_counter() - started
             # Check for changes
             if not self.cachedUserList == None:
                 self.logger.debug("Check UserList for changes...")
                 ids = self.getUserIdsWithChanges()
+                self.tick['users'] = len(ids)
 
+                transactionsStarted = time.perf_counter()
                 for id in ids:
                     since = self.cachedUserList.get(id)
                     self.processLastTransactions(id, since)
+                self.tick['transactions'] = time.perf_counter() - transactionsStarted
 
             # No LastUserList or invalid List = no changes. Save list.
             else:
@@ -350,11 +1079,14 @@ class StrichlisteWatcher(threading.Thread):
                     "First run. Cache only UserList.")
 
             self.updateCachedUserList()
+            self.tick['error'] = False
 
         except Exception as ex:
             self.logger.exception("Exception caught in loop! " + str(ex) +
                                   " Traceback: " + traceback.format_exc())
 
+        self.tick['total'] = time.perf_counter() - started
+        self.tickTimings.append(self.tick)
         time.sleep(config.strichliste['interval'])
 
     def stop(self):
@@ -372,9 +1104,11 @@ class StrichlisteWatcher(threading.Thread):
         self.logger.debug("Process Transactions for user %d since %s" %
                          (userid, since))
 
-        req = requests.get(config.strichliste['apiurl'] +
-                           "/user/%d/transaction" % userid)
+        started = time.perf_counter()
+        req = self.main.request("GET", "strichliste",
+                                "/user/%d/transaction" % userid)
         jsonUserTransactions = req.json()
+        self.tick['fetch'] += time.perf_counter() - started
 
         if jsonUserTransactions["transactions"]:
             for transaction in jsonUserTransactions["transactions"]:
@@ -494,6 +1228,10 @@ class StrichlisteWatcher(threading.Thread):
                                                                             ))
                             self.main.send_msg(
                                 message, markup="HTML", chatID=chatid)
+
+                        self.main.alerts.processTransaction(
+                            transaction, transactType, isUndo, chatid)
+
                     elif not chatid and transactType == TransactionType.SEND_MONEY:
                         comment = transaction['comment'].strip()
 
@@ -567,11 +1305,37 @@ class StrichlisteTelegramBot():
         self.logger = logging.getLogger(self.__class__.__name__)
         self.pendingActivations = {}
         self.authorizedUsers = {}
-        self.authorizedUsersFile = scriptdir + "/" + config.authorizedUsersFile
+        # reverse index of authorizedUsers: chatid -> Strichliste UserID
+        self.authorizedChats = {}
+        # listener, watcher and broadcaster change both, hold it for writes
+        self.authorizedUsersLock = threading.RLock()
+        self.authorizedUsersFile = os.path.join(
+            scriptdir, config.authorizedUsersFile)
+        self.broadcastStateFile = os.path.join(
+            scriptdir, getattr(config, 'broadcastStateFile', "broadcast.json"))
+        self.threadBroadcaster = None
+        self.threadArticleCatalog = None
+        self.trafficRecorder = None
+        self.debugHooks = DebugHooks(self)
+        self.bot_url = config.telegram['apiurl'] + config.telegram['bottoken']
 
         # load Authorized user list
         self.loadAuthorizedUsers()
 
+        self.alerts = AlertEngine(self, os.path.join(
+            scriptdir, getattr(config, 'alertRulesFile', "alertRules.json")))
+
+        # record HTTP traffic if enabled
+        trace = getattr(config, 'trace', {})
+        if trace.get('enabled'):
+            filename = os.path.join(
+                scriptdir, trace.get('file', "trace.jsonl.gz"))
+            # one file per run, a killed run never gets closed properly and
+            # appending to it would break the gzip stream
+            base, dot, extension = os.path.basename(filename).partition('.')
+            self.trafficRecorder = TrafficRecorder(os.path.join(os.path.dirname(filename),
+                base + "-" + datetime.now().strftime('%Y%m%d-%H%M%S') + dot + extension))
+
         self.logger.info("Strichliste Telegram Bridge starting...")
 
     # start StrichlisteWatcher
@@ -598,13 +1362,24 @@ class StrichlisteTelegramBot():
             self.threadStrichlisteWatcher.stop()
             self.threadStrichlisteWatcher = None
 
+    # starts the article catalog thread
+    def start_ArticleCatalog(self):
+        if self.threadArticleCatalog is None:
+            self.logger.info("Starting Thread ArticleCatalog.")
+            self.threadArticleCatalog = ArticleCatalog(self)
+            self.threadArticleCatalog.start()
+
+    def stop_ArticleCatalog(self):
+        if self.threadArticleCatalog is not None:
+            self.logger.info("Stopping Thread ArticleCatalog.")
+            self.threadArticleCatalog.stop()
+            self.threadArticleCatalog = None
+
     # starts the telegram listener thread
     def start_TelegramListener(self):
         if config.telegram['bottoken'] != "" and config.telegram['apiurl'] != "":
             if self.threadTelegramListener is None:
                 self.logger.info("Starting Thread TelegramListener.")
-                self.bot_url = config.telegram['apiurl'] + \
-                    config.telegram['bottoken']
                 self.threadTelegramListener = TelegramListener(self)
                 self.threadTelegramListener.start()
         else:
@@ -635,7 +1410,7 @@ class StrichlisteTelegramBot():
                 myArr = []
                 for k in responses:
                     myArr.append(
-                        map(lambda x: {"text": x[0], "callback_data": x[1]}, k))
+                        [{"text": x[0], "callback_data": x[1]} for x in k])
                 keyboard = {'inline_keyboard': myArr}
                 data['reply_markup'] = json.dumps(keyboard)
 
@@ -645,17 +1420,140 @@ class StrichlisteTelegramBot():
             data['chat_id'] = chatID
 
             data['text'] = message
-            r = requests.post(self.bot_url + "/sendMessage", data=data)
+            r = self.request("POST", "telegram", "/sendMessage", data=data)
             if r.status_code != 200:
                 self.logger.warning(
                     "Sending finished, but with status code %s.", str(r.status_code))
             else:
                 self.logger.debug("Sending finished. " + str(r.status_code))
+            return r
 
         except Exception as ex:
             self.logger.exception(
                 "Caught an exception in send_msg(): " + str(ex))
 
+    # Sends a request to the Telegram (path below bot_url) or Strichliste
+    # (path below apiurl) API and hands the exchange to the TrafficRecorder
+    def request(self, method, service, path, **kwargs):
+        if service == "telegram":
+            url = self.bot_url + path
+        else:
+            url = config.strichliste['apiurl'] + path
+
+        if self.trafficRecorder is None:
+            return requests.request(method, url, **kwargs)
+
+        started = time.time()
+        try:
+            response = requests.request(method, url, **kwargs)
+        except Exception as ex:
+            self.trafficRecorder.record(service, method, path, started, params=kwargs.get(
+                'params'), data=kwargs.get('data', kwargs.get('json')), error=str(ex))
+            raise
+        self.trafficRecorder.record(service, method, path, started, params=kwargs.get(
+            'params'), data=kwargs.get('data', kwargs.get('json')), response=response)
+        return response
+
+    def isAdmin(self, telegram_chat_id):
+        return str(telegram_chat_id) in [str(admin) for admin in getattr(config, 'admins', [])]
+
+    # Starts a broadcast to all mapped chats. Returns False if one is running.
+    def startBroadcast(self, message, reportChatID=None):
+        if self.threadBroadcaster is not None and self.threadBroadcaster.is_alive():
+            return False
+        with self.authorizedUsersLock:
+            recipients = {authorizedUser['chatid']: "pending"
+                          for authorizedUser in self.authorizedUsers.values()}
+        state = dict(message=message,
+                     created=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                     reportChatID=reportChatID,
+                     finished=False,
+                     recipients=recipients,
+                     attempts={})
+        self.saveBroadcastState(state)
+        self.threadBroadcaster = Broadcaster(self, state)
+        self.threadBroadcaster.start()
+        return True
+
+    # Resumes an interrupted broadcast. Returns False if there is none or it
+    # is older than maxAge seconds.
+    def resumeBroadcast(self, maxAge=None):
+        if self.threadBroadcaster is not None and self.threadBroadcaster.is_alive():
+            return False
+        if not os.path.isfile(self.broadcastStateFile):
+            return False
+        try:
+            with open(self.broadcastStateFile, 'r') as f:
+                state = json.load(f)
+        except Exception as ex:
+            self.logger.exception(
+                "Caught an exception in resumeBroadcast(): %s", ex)
+            return False
+        state.setdefault('attempts', {})
+        if state.get('finished') or not any(Broadcaster.isRetryable(state, chatid) for chatid in state['recipients']):
+            return False
+        age = time.time() - datetime.strptime(state['created'], '%Y-%m-%d %H:%M:%S').timestamp()
+        if maxAge is not None and age > maxAge:
+            # the message is probably outdated by now
+            self.logger.warning(
+                "Not resuming broadcast from %s, it is too old.", state['created'])
+            state['finished'] = True
+            self.saveBroadcastState(state)
+            return False
+        self.logger.info("Resuming broadcast from %s.", state['created'])
+        self.threadBroadcaster = Broadcaster(self, state)
+        self.threadBroadcaster.start()
+        return True
+
+    def stopBroadcast(self):
+        if self.threadBroadcaster is not None:
+            self.logger.info("Stopping Thread Broadcaster.")
+            self.threadBroadcaster.stop()
+            self.threadBroadcaster = None
+
+    def saveBroadcastState(self, state):
+        try:
+            with open(self.broadcastStateFile, 'w') as f:
+                json.dump(state, f)
+
+        except Exception as ex:
+            self.logger.exception(
+                "Caught an exception in saveBroadcastState(): %s", ex)
+
+    def edit_msg(self, message="", chatID="", messageID="", markup=None, **kwargs):
+        try:
+            self.logger.debug(
+                "Editing message %s: " % str(messageID) + message.replace("\n", "\\n") + " chatID=" + str(chatID))
+            # an edit without reply_markup removes the inline keyboard
+            data = dict(chat_id=chatID, message_id=messageID, text=message)
+            if markup is not None:
+                if "HTML" in markup or "Markdown" in markup:
+                    data["parse_mode"] = markup
+            r = self.request("POST", "telegram", "/editMessageText", data=data)
+            if r.status_code != 200:
+                self.logger.warning(
+                    "Editing finished, but with status code %s.", str(r.status_code))
+            return r
+
+        except Exception as ex:
+            self.logger.exception(
+                "Caught an exception in edit_msg(): " + str(ex))
+
+    def answer_callback(self, callbackID, text=None):
+        try:
+            data = dict(callback_query_id=callbackID)
+            if text is not None:
+                data['text'] = text
+            r = self.request("POST", "telegram", "/answerCallbackQuery", data=data)
+            if r.status_code != 200:
+                self.logger.warning(
+                    "Answering callback finished, but with status code %s.", str(r.status_code))
+            return r
+
+        except Exception as ex:
+            self.logger.exception(
+                "Caught an exception in answer_callback(): " + str(ex))
+
     def randomStringDigits(self, stringLength=8):
         lettersAndDigits = string.ascii_letters + string.digits
         return ''.join(random.choice(lettersAndDigits) for i in range(stringLength))
@@ -666,7 +1564,7 @@ class StrichlisteTelegramBot():
             return
 
         try:
-            with open(self.authorizedUsersFile, 'w') as f:
+            with self.authorizedUsersLock, open(self.authorizedUsersFile, 'w') as f:
                 json.dump(self.authorizedUsers, f)
 
             self.logger.debug("authorizedUsersFile successful saved")
@@ -680,7 +1578,7 @@ class StrichlisteTelegramBot():
             self.logger.error("authorizedUsersFile is not set!")
             sys.exit()
 
-        if not os.path.isfile(config.authorizedUsersFile) or os.stat(self.authorizedUsersFile).st_size == 0:
+        if not os.path.isfile(self.authorizedUsersFile) or os.stat(self.authorizedUsersFile).st_size == 0:
             try:
                 with open(self.authorizedUsersFile, 'w') as outfile:
                     data = {}
@@ -692,7 +1590,11 @@ class StrichlisteTelegramBot():
 
         try:
             with open(self.authorizedUsersFile, 'r') as f:
-                self.authorizedUsers = json.load(f)
+                authorizedUsers = json.load(f)
+            with self.authorizedUsersLock:
+                self.authorizedUsers = authorizedUsers
+                self.authorizedChats = {authorizedUser['chatid']: sl_id for sl_id,
+                                        authorizedUser in authorizedUsers.items()}
 
             self.logger.debug("authorizedUsersFile successful loaded")
 
@@ -704,18 +1606,40 @@ class StrichlisteTelegramBot():
     def addAuthorizedUsers(self, sl_id, telegram_chat_id):
         self.logger.debug(
             "Adding Strichliste UserID '%s' with Telegram ChatID '%s' to authorized user list.", str(sl_id), str(telegram_chat_id))
-        old_sl_id = self.isAuthorizedUser(telegram_chat_id=telegram_chat_id)
-        if old_sl_id:
-            self.deleteAuthorizedUsers(old_sl_id)
-        self.authorizedUsers[str(sl_id)] = dict(
-            chatid=telegram_chat_id, updated=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-        self.saveAuthorizedUsers()
+        with self.authorizedUsersLock:
+            old_sl_id = self.isAuthorizedUser(telegram_chat_id=telegram_chat_id)
+            # mapping the same account again keeps its alert rules
+            if old_sl_id and old_sl_id != str(sl_id):
+                self.deleteAuthorizedUsers(old_sl_id)
+            if str(sl_id) in self.authorizedUsers:
+                # account is mapped to another chat so far
+                self.authorizedChats.pop(
+                    self.authorizedUsers[str(sl_id)]['chatid'], None)
+            self.authorizedUsers[str(sl_id)] = dict(
+                chatid=telegram_chat_id, updated=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+            self.authorizedChats[telegram_chat_id] = str(sl_id)
+            self.saveAuthorizedUsers()
 
     def deleteAuthorizedUsers(self, sl_id):
         self.logger.debug(
             "Deleting Strichliste UserID '%s' from authorized user list.", str(sl_id))
-        del self.authorizedUsers[str(sl_id)]
-        self.saveAuthorizedUsers()
+        with self.authorizedUsersLock:
+            authorizedUser = self.authorizedUsers.pop(str(sl_id), None)
+            if authorizedUser is None:
+                # unmapped by another thread meanwhile
+                return
+            self.authorizedChats.pop(authorizedUser['chatid'], None)
+            self.saveAuthorizedUsers()
+        self.alerts.deleteRules(sl_id)
+
+    # Unmaps the account mapped to telegram_chat_id. Returns its Strichliste
+    # UserID or False if the chat is not mapped.
+    def deleteAuthorizedChat(self, telegram_chat_id):
+        with self.authorizedUsersLock:
+            sl_id = self.isAuthorizedUser(telegram_chat_id=telegram_chat_id)
+            if sl_id:
+                self.deleteAuthorizedUsers(sl_id)
+            return sl_id
 
     def isAuthorizedUser(self, strichliste_user_id=None, telegram_chat_id=None, **kwargs):
         if strichliste_user_id != None:
@@ -724,19 +1648,21 @@ class StrichlisteTelegramBot():
             else:
                 return False
         elif telegram_chat_id != None:
-            for sl_id, authorizedUser in self.authorizedUsers.items():
-                if authorizedUser['chatid'] == telegram_chat_id:
-                    return sl_id
-            return False
+            return self.authorizedChats.get(telegram_chat_id, False)
         else:
             raise(Exception(
                 str("You must set the attributes strichliste_user_id or telegram_chat_id")))
 
     def getUserInfo(self, userid):
-        req = requests.get(config.strichliste['apiurl'] +
+        req = self.request("GET", "strichliste",
                            "/user/%s" % str(userid))
         return req.json()
 
+    def getUserTransactions(self, userid, limit=100):
+        req = self.request("GET", "strichliste",
+                           "/user/%s/transaction" % str(userid), params={'limit': limit})
+        return req.json()
+
 
 def main():
     # Setup Logger
@@ -744,8 +1670,12 @@ def main():
                         format='%(asctime)s %(funcName)s@%(name)s (%(threadName)s): %(message)s')
 
     strichliste = StrichlisteTelegramBot()
+    strichliste.debugHooks.installSignalHandlers()
     strichliste.start_StrichlisteWatcher()
     strichliste.start_TelegramListener()
+    strichliste.start_ArticleCatalog()
+    strichliste.resumeBroadcast(
+        maxAge=getattr(config, 'broadcast', {}).get('maxAge', 3600))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,50 @@
+#!/usr/bin/python3 -u
+
+# Sends a message to all mapped chats, or resumes an interrupted broadcast.
+# Chats which blocked the bot get unmapped. Stop the bridge while running
+# this, otherwise it overwrites the unmapped chats with its own list.
+#
+# ./broadcast.py "Kiosk is down for maintenance"
+# ./broadcast.py --resume
+
+import argparse
+import logging
+
+import config
+import bot
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Broadcast a message to all mapped chats.")
+    parser.add_argument('message', nargs='?', help="message to send")
+    parser.add_argument('--resume', action='store_true',
+                        help="resume the last interrupted broadcast")
+    args = parser.parse_args()
+    if (args.message is None) == (not args.resume):
+        parser.error("give either a message or --resume")
+
+    # progress is reported by the Broadcaster on INFO
+    logging.basicConfig(level=min(config.logginglevel, logging.INFO),
+                        format='%(asctime)s %(funcName)s@%(name)s (%(threadName)s): %(message)s')
+
+    strichliste = bot.StrichlisteTelegramBot()
+    if args.resume:
+        if not strichliste.resumeBroadcast():
+            print("No interrupted broadcast found.")
+            return
+    else:
+        strichliste.startBroadcast(args.message)
+
+    thread = strichliste.threadBroadcaster
+    try:
+        while thread.is_alive():
+            thread.join(1)
+    except KeyboardInterrupt:
+        # the state is saved after every batch, --resume continues from there
+        strichliste.stopBroadcast()
+        thread.join()
+
+
+if __name__ == '__main__':
+    main()
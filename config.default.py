@@ -11,4 +11,32 @@ strichliste = dict(
     interval=5,
     activation_token_len=10
 )
-authorizedUsersFile = "authorizedUsers.json"
\ No newline at end of file
+# article list for /buy
+articles = dict(
+    ttl=300,  # seconds between refreshes
+    limit=1000
+)
+authorizedUsersFile = "authorizedUsers.json"
+alertRulesFile = "alertRules.json"
+broadcastStateFile = "broadcast.json"
+# Telegram chat ids allowed to /broadcast
+admins = []
+broadcast = dict(
+    rate=25,  # messages per second, Telegram allows about 30
+    attempts=3,  # tries per chat on network or server errors
+    retryDelay=10,  # seconds before the first retry, doubled for each retry
+    maxAge=3600  # seconds, older broadcasts are not resumed on start
+)
+# /debug and SIGUSR1/SIGUSR2, see README
+debug = dict(
+    dir="debug",
+    ticks=20,  # watcher ticks to keep timings of, 0 disables
+    profileSeconds=30,
+    sampleInterval=0.01
+)
+# Record all Strichliste and Telegram HTTP traffic for replay.py.
+# Traces contain messages and user data, handle them with care!
+trace = dict(
+    enabled=False,
+    file="trace.jsonl.gz"  # gets the start time appended, one file per run
+)
\ No newline at end of file
@@ -0,0 +1,323 @@
+#!/usr/bin/python3 -u
+
+# Replays a trace written by the TrafficRecorder (see config.trace) through
+# the bridge. Strichliste and Telegram are replaced by local stand-in servers
+# which answer every request with the next recorded response for the same
+# method and path, not earlier than it was answered in the recording.
+#
+# ./replay.py trace-*.jsonl.gz --speed 10 --users authorizedUsers.json
+
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+import argparse
+import logging
+import threading
+import tempfile
+import shutil
+import os.path
+import time
+import json
+import zlib
+
+import config
+import bot
+
+
+# Returns the decompressed gzip members of data. A member of a killed bridge
+# has no end and may be followed by the next run's member, so a broken
+# member is kept up to the last byte that decompressed and reading goes on
+# at the next gzip header.
+def readMembers(data, chunk=65536):
+    logger = logging.getLogger("readMembers")
+    members = []
+    pos = 0
+    while pos < len(data):
+        decompressor = zlib.decompressobj(wbits=31)
+        output = []
+        start = pos
+        broken = None
+        while pos < len(data) and not decompressor.eof:
+            block = data[pos:pos + chunk]
+            backup = decompressor.copy()
+            try:
+                output.append(decompressor.decompress(block))
+                pos += len(block)
+            except zlib.error:
+                # redo the block bytewise to keep everything before the error
+                decompressor = backup
+                for i in range(len(block)):
+                    try:
+                        output.append(decompressor.decompress(block[i:i + 1]))
+                    except zlib.error:
+                        broken = pos + i
+                        break
+                else:
+                    broken = pos + len(block)
+                break
+        members.append(b"".join(output))
+
+        if broken is not None:
+            logger.warning("Broken gzip member at byte %d. Using what we got.", broken)
+            # the header of the next member may already be read partly
+            nextMember = data.find(b"\x1f\x8b\x08", max(start + 1, broken - 16))
+            if nextMember < 0:
+                break
+            pos = nextMember
+        elif decompressor.eof:
+            pos -= len(decompressor.unused_data)
+        else:
+            logger.warning("Trace ends unexpectedly. Using what we got.")
+    return members
+
+
+def loadTrace(filenames):
+    logger = logging.getLogger("loadTrace")
+    entries = []
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            members = readMembers(f.read())
+        for member in members:
+            for line in member.decode('utf-8', errors='replace').splitlines():
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    logger.warning("Skipping broken line in %s.", filename)
+    entries.sort(key=lambda entry: entry['t'])
+    return entries
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, service, entries, prefix, start, speed):
+        ThreadingHTTPServer.__init__(self, ('127.0.0.1', 0), StandInHandler)
+        self.service = service
+        self.prefix = prefix
+        self.start = start
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.queues = {}
+        self.lastEntries = {}
+        self.stats = {}
+        self.url = "http://127.0.0.1:%d" % self.server_address[1]
+
+        traceStart = entries[0]['t'] if entries else 0
+        for entry in entries:
+            if entry['service'] == service and 'status' in entry:
+                # answer at the offset the response arrived in the recording
+                entry['due'] = (entry['t'] + entry['elapsed'] - traceStart) / speed
+                self.queues.setdefault(
+                    (entry['method'], entry['path']), deque()).append(entry)
+
+    def pending(self):
+        with self.lock:
+            return sum(len(queue) for queue in self.queues.values())
+
+    def nextEntry(self, method, path):
+        key = (method, path)
+        with self.lock:
+            queue = self.queues.get(key)
+            if queue:
+                entry = queue.popleft()
+                self.lastEntries[key] = entry
+                return entry, True
+            return self.lastEntries.get(key), False
+
+    def countRequest(self, method, path, lag):
+        with self.lock:
+            stat = self.stats.setdefault("%s %s" % (method, path), dict(
+                requests=0, replayed=0, lags=[]))
+            stat['requests'] += 1
+            if lag is not None:
+                stat['replayed'] += 1
+                stat['lags'].append(lag)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+    def do_HEAD(self):
+        # used by the bridge to test the Strichliste API url
+        self.send_response(200)
+        self.end_headers()
+
+    def do_GET(self):
+        self.answer("GET")
+
+    def do_POST(self):
+        length = int(self.headers.get('content-length', 0))
+        self.rfile.read(length)
+        self.answer("POST")
+
+    def answer(self, method):
+        server = self.server
+        arrived = time.time() - server.start
+        path = urlsplit(self.path).path
+        if path.startswith(server.prefix):
+            path = path[len(server.prefix):]
+        # strichliste paths contain the user id, keep them apart
+        entry, fresh = server.nextEntry(method, path)
+
+        lag = None
+        if fresh:
+            lag = max(0, arrived - entry['due'])
+            wait = entry['due'] - arrived
+            if wait > 0:
+                time.sleep(wait)
+        elif server.service == "telegram" and path == "/getUpdates":
+            # nothing left to poll, don't let the listener spin
+            entry = None
+            time.sleep(min(1, 30 / server.speed))
+        server.countRequest(method, path, lag)
+
+        if entry is not None:
+            status = entry['status']
+            contentType = entry['contentType'] or 'application/json'
+            body = entry['body'].encode('utf-8')
+        elif server.service == "telegram":
+            status = 200
+            contentType = 'application/json'
+            body = json.dumps(dict(ok=True, result=[])).encode('utf-8')
+        else:
+            status = 404
+            contentType = 'application/json'
+            body = json.dumps(dict(error="not in trace")).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('content-type', contentType)
+        self.send_header('content-length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def report(servers, duration):
+    result = dict(duration=duration, endpoints={})
+    for server in servers:
+        for endpoint, stat in server.stats.items():
+            lags = stat['lags']
+            result['endpoints'][server.service + " " + endpoint] = dict(
+                requests=stat['requests'],
+                replayed=stat['replayed'],
+                lagMean=(sum(lags) / len(lags)) if lags else None,
+                lagP95=percentile(lags, 0.95) if lags else None,
+                lagMax=max(lags) if lags else None)
+        result.setdefault('pending', {})[server.service] = server.pending()
+    return result
+
+
+def printReport(result):
+    print("Replay finished after %.1fs" % result['duration'])
+    print("%-50s %8s %8s %9s %9s %9s" %
+          ("Endpoint", "Requests", "Replayed", "Lag mean", "Lag p95", "Lag max"))
+    for endpoint, stat in sorted(result['endpoints'].items()):
+        lags = ["%8.3fs" % stat[key] if stat[key] is not None else "%9s" % "---"
+                for key in ('lagMean', 'lagP95', 'lagMax')]
+        print("%-50s %8d %8d %s %s %s" %
+              (endpoint, stat['requests'], stat['replayed'], *lags))
+    for service, pending in result['pending'].items():
+        if pending:
+            print("%d recorded %s responses were never requested." %
+                  (pending, service))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay a recorded trace through the Strichliste Telegram Bridge.")
+    parser.add_argument('trace', nargs='+',
+                        help="trace files written by the TrafficRecorder, one per run of the bridge")
+    parser.add_argument('--speed', type=float, default=1,
+                        help="replay speed, 1 is real time (default: 1)")
+    parser.add_argument('--users', default=os.path.join(bot.scriptdir, config.authorizedUsersFile),
+                        help="authorized users file to start with (is not modified)")
+    parser.add_argument('--alerts', default=os.path.join(bot.scriptdir, getattr(config, 'alertRulesFile', "alertRules.json")),
+                        help="alert rules file to start with (is not modified)")
+    parser.add_argument('--grace', type=float, default=5,
+                        help="seconds to wait for the bridge after the trace ended")
+    parser.add_argument('--record', help="record the replayed traffic to this file")
+    parser.add_argument('--json', help="write the report as json to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=config.logginglevel,
+                        format='%(asctime)s %(funcName)s@%(name)s (%(threadName)s): %(message)s')
+
+    entries = loadTrace(args.trace)
+    if not entries:
+        print("Trace is empty.")
+        return
+    start = time.time()
+    strichliste = StandInServer("strichliste", entries, "", start, args.speed)
+    telegram = StandInServer("telegram", entries, "/botreplay", start, args.speed)
+    servers = [strichliste, telegram]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, name=server.service, daemon=True).start()
+
+    # point the bridge to the stand-ins and work on copies of its state
+    tmpdir = tempfile.mkdtemp()
+    usersFile = os.path.join(tmpdir, "authorizedUsers.json")
+    if os.path.isfile(args.users):
+        shutil.copy(args.users, usersFile)
+    config.authorizedUsersFile = usersFile
+    alertsFile = os.path.join(tmpdir, "alertRules.json")
+    if os.path.isfile(args.alerts):
+        shutil.copy(args.alerts, alertsFile)
+    config.alertRulesFile = alertsFile
+    config.broadcastStateFile = os.path.join(tmpdir, "broadcast.json")
+    config.debug = dict(getattr(config, 'debug', {}))
+    config.debug['dir'] = os.path.join(tmpdir, "debug")
+    config.strichliste['apiurl'] = strichliste.url
+    config.strichliste['interval'] = config.strichliste['interval'] / args.speed
+    config.telegram['apiurl'] = telegram.url + "/bot"
+    config.telegram['bottoken'] = "replay"
+    config.telegram['retry'] = config.telegram['retry'] / args.speed
+    config.articles = dict(getattr(config, 'articles', {}))
+    config.articles['ttl'] = config.articles.get('ttl', 300) / args.speed
+    config.trace = dict(enabled=False)
+
+    bridge = bot.StrichlisteTelegramBot()
+    if args.record:
+        bridge.trafficRecorder = bot.TrafficRecorder(args.record)
+    bridge.start_StrichlisteWatcher()
+    bridge.start_TelegramListener()
+    bridge.start_ArticleCatalog()
+    threads = [bridge.threadStrichlisteWatcher, bridge.threadTelegramListener,
+               bridge.threadArticleCatalog]
+
+    traceEnd = (entries[-1]['t'] + entries[-1].get('elapsed', 0) - entries[0]['t']) / args.speed
+    try:
+        while time.time() - start < traceEnd + args.grace:
+            if strichliste.pending() == 0 and telegram.pending() == 0:
+                break
+            time.sleep(0.1)
+    except KeyboardInterrupt:
+        pass
+    duration = time.time() - start
+
+    bridge.stop_StrichlisteWatcher()
+    bridge.stop_listening()
+    bridge.stop_ArticleCatalog()
+    for thread in threads:
+        if thread is not None:
+            thread.join()
+    if bridge.trafficRecorder is not None:
+        bridge.trafficRecorder.close()
+    for server in servers:
+        server.shutdown()
+    shutil.rmtree(tmpdir)
+
+    result = report(servers, duration)
+    printReport(result)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()